@@ -0,0 +1,52 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+"""
+Optional compiled versions of clean_ident / split_qualified from
+ch_view_dependencies.py, scanning the str buffer as Py_UCS4 code points.
+
+Build in place (needs Cython and a C compiler):
+
+    cythonize -i _ch_ident.pyx
+
+ch_view_dependencies falls back to the pure-Python versions when this
+module is not built.
+"""
+
+cdef inline bint _is_open_quote(Py_UCS4 c):
+    return c == u'`' or c == u'"' or c == u'['
+
+cdef inline bint _is_close_quote(Py_UCS4 c):
+    return c == u'`' or c == u'"' or c == u']'
+
+cdef str _clean(str s, Py_ssize_t start, Py_ssize_t end):
+    cdef Py_UCS4 c
+    while start < end:
+        c = s[start]
+        if not c.isspace():
+            break
+        start += 1
+    while end > start:
+        c = s[end - 1]
+        if not c.isspace():
+            break
+        end -= 1
+    if start < end and _is_open_quote(s[start]):
+        start += 1
+    if start < end and _is_close_quote(s[end - 1]):
+        end -= 1
+    # ClickHouse can escape backticks by doubling; handle minimal cases:
+    return s[start:end].replace(u'``', u'`').replace(u'""', u'"')
+
+cpdef str clean_ident(str s):
+    """Remove common ClickHouse identifier quoting."""
+    return _clean(s, 0, len(s))
+
+cpdef tuple split_qualified(str name):
+    """
+    Split db.table -> (db, table). If unqualified -> (None, name).
+    Handles backticks/quotes in a simplistic way by cleaning each part.
+    """
+    cdef Py_ssize_t n = len(name)
+    cdef Py_ssize_t dot = name.find(u'.')
+    if dot >= 0 and name.find(u'.', dot + 1) < 0:
+        return _clean(name, 0, dot), _clean(name, dot + 1, n)
+    return None, _clean(name, 0, n)
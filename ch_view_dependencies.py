@@ -5,8 +5,9 @@ ClickHouse VIEW dependency extractor (ANTLR-based)
 What it does:
 1) Connects to ClickHouse using clickhouse_connect
 2) Collects all ClickHouse views (VIEW / MATERIALIZED VIEW / LIVE VIEW)
-3) Fetches DDL for each view
-4) Parses DDL using ClickHouse ANTLR4 grammar (from ClickHouse repo utils/antlr)
+3) Fetches DDL for all views (single system.tables query)
+4) Parses DDL with a single-pass token scanner, falling back to the ClickHouse ANTLR4
+   grammar (from ClickHouse repo utils/antlr) for constructs it does not model
 5) Produces: { "db.view": ["db.table1", "table2", ...] }
 
 Prereqs (one-time):
@@ -34,13 +35,20 @@ Output:
 from __future__ import annotations
 
 import argparse
+import functools
+import hashlib
+import json
 import os
+import queue
 import re
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
-from typing import Dict, List, Optional, Set, Tuple
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 from pathlib import Path
 
 import clickhouse_connect
+from clickhouse_connect.driver import httputil
 
 # ---- ANTLR runtime ----
 from antlr4 import CommonTokenStream, InputStream
@@ -56,7 +64,7 @@ from antlr4 import CommonTokenStream, InputStream
 from generated_ch_parser.ClickHouseLexer import ClickHouseLexer
 from generated_ch_parser.ClickHouseParser import ClickHouseParser
 from generated_ch_parser.ClickHouseParserVisitor import ClickHouseParserVisitor
-from dependencies_to_mermaid import MermaidOptions, json_to_mermaid
+from dependencies_to_mermaid import MermaidOptions, iter_json_to_mermaid
 
 # ----------------------------
 # Helpers
@@ -83,19 +91,227 @@ def split_qualified(name: str) -> Tuple[Optional[str], str]:
         return clean_ident(parts[0]), clean_ident(parts[1])
     return None, clean_ident(name)
 
+# Compiled drop-in replacements, if built (see _ch_ident.pyx)
+try:
+    from _ch_ident import clean_ident, split_qualified  # type: ignore[no-redef]
+except ImportError:
+    pass
+
 def normalize_table_name(
     raw: str,
     default_db: Optional[str],
-) -> str:
+) -> Tuple[str, str]:
     """
-    Normalize to 'db.table' when db is known, otherwise return 'table'.
+    Normalize to 'db.table' when db is known, otherwise 'table'.
+    Returns (normalized, unqualified table) from a single split/clean pass.
     """
     db, tbl = split_qualified(raw)
     if db:
-        return f"{db}.{tbl}"
+        return f"{db}.{tbl}", tbl
     if default_db:
-        return f"{default_db}.{tbl}"
-    return tbl
+        return f"{default_db}.{tbl}", tbl
+    return tbl, tbl
+
+
+# ----------------------------
+# Single-pass scanner (fast path)
+# ----------------------------
+
+# One master pattern splits the DDL into tokens in a single linear pass.
+# Comments and whitespace are skipped; string literals are kept as opaque tokens
+# so keywords inside them are never seen.
+_TOKEN_RE = re.compile(
+    r"""
+      (?P<ws>\s+)
+    | (?P<comment>--[^\n]*|/\*.*?\*/)
+    | (?P<string>'(?:[^'\\]|\\.|'')*')
+    | (?P<ident>`(?:[^`]|``)*`|"(?:[^"]|"")*"|\w+)
+    | (?P<punct>.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+# Words that end a FROM item (so they are never taken as a table alias)
+_FROM_ITEM_END = frozenset({
+    "ANTI", "ANY", "ARRAY", "ASOF", "CROSS", "EXCEPT", "FORMAT", "FULL", "GLOBAL",
+    "GROUP", "HAVING", "INNER", "INTERSECT", "JOIN", "LEFT", "LIMIT", "LOCAL", "ON",
+    "ORDER", "OUTER", "PASTE", "PREWHERE", "QUALIFY", "RIGHT", "SAMPLE", "SEMI",
+    "SETTINGS", "UNION", "USING", "WHERE", "WINDOW",
+})
+
+# Scanner states (per parenthesis level)
+_IDLE, _EXPECT_TABLE, _AFTER_TABLE = 0, 1, 2
+
+class _WithGroup:
+    """CTE names of one WITH list, in scope for token positions [start, end)."""
+    __slots__ = ("names", "start", "end", "branch_local")
+
+    def __init__(self, start: int, branch_local: bool):
+        self.names: Set[str] = set()
+        self.start = start
+        self.end = sys.maxsize
+        self.branch_local = branch_local  # WITH on a later UNION branch
+
+class _Frame:
+    """
+    One parenthesis level: whether it holds a query, the state to resume on ')',
+    and the WITH lists seen at this level.
+    """
+    __slots__ = (
+        "is_query", "resume_state", "bail_if_not_query",
+        "with_groups", "current_with", "after_union",
+    )
+
+    def __init__(self, resume_state: int, bail_if_not_query: bool):
+        self.is_query: Optional[bool] = None  # decided by the first token inside
+        self.resume_state = resume_state
+        self.bail_if_not_query = bail_if_not_query
+        self.with_groups: List[_WithGroup] = []
+        # WITH list still being read (closed by the SELECT that follows it)
+        self.current_with: Optional[_WithGroup] = None
+        self.after_union = False
+
+def extract_tables_dfa(ddl: str, default_db: Optional[str]) -> Optional[List[str]]:
+    """
+    Extract FROM/JOIN table references in one pass over the DDL tokens.
+
+    Tracks parenthesis depth, and whether each level is a query
+    ("(SELECT ...)") or an expression ("EXTRACT(YEAR FROM d)"), so
+    subqueries, comma joins, table functions, ARRAY JOIN and FROM-keyword
+    functions are handled without a parser.
+
+    CTE names follow the same scoping as TableNameCollector: every name in a
+    WITH list is visible from the WITH keyword on, including inside earlier CTE
+    bodies of the same list; the first WITH of a level covers all its UNION
+    branches, a WITH on a later branch only that branch. References are
+    filtered once the whole list is known.
+
+    Returns None when the DDL has constructs the scanner doesn't model
+    (parenthesized joins, "AS (" outside a WITH list, unbalanced input);
+    callers fall back to ANTLR.
+    """
+    # (raw table ref, token position, enclosing levels at that point)
+    refs: List[Tuple[str, int, List[_Frame]]] = []
+    root = _Frame(_IDLE, bail_if_not_query=False)
+    root.is_query = True  # top level of CREATE VIEW ... AS SELECT
+    frames: List[_Frame] = []
+    is_query = True
+    state = _IDLE
+    has_alias = False
+    pending: Optional[str] = None  # table ref being read: "db" / "db." / "db.tbl"
+    prev = prev2 = ""  # previous two significant tokens, as written
+    prev_word: Optional[str] = None  # upper-cased prev when it is a bare word
+    pos = -1
+
+    for m in _TOKEN_RE.finditer(ddl):
+        kind = m.lastgroup
+        if kind == "ws" or kind == "comment":
+            continue
+        pos += 1
+        tok = m.group()
+        if kind == "punct" and tok in "'`\"":
+            return None  # unterminated literal / identifier
+        word = tok.upper() if kind == "ident" and tok[0] not in '`"' else None
+        if word is not None and prev == ".":
+            word = None  # t.from is a column, not a keyword
+
+        if frames and frames[-1].is_query is None:
+            frame = frames[-1]
+            frame.is_query = is_query = word in ("SELECT", "WITH")
+            if not is_query and frame.bail_if_not_query:
+                return None  # FROM (a JOIN b): parenthesized join
+
+        if pending is not None:
+            if tok == "." and not pending.endswith("."):
+                pending += "."
+                prev2, prev, prev_word = prev, tok, None
+                continue
+            if pending.endswith("."):
+                if kind != "ident":
+                    return None
+                pending += tok
+                prev2, prev, prev_word = prev, tok, None
+                continue
+            if tok != "(":  # "(" means a table function: not a table
+                refs.append((pending, pos, [root, *frames]))
+            pending = None
+            state, has_alias = _AFTER_TABLE, False
+
+        if tok == "(":
+            if state == _EXPECT_TABLE:
+                frames.append(_Frame(_AFTER_TABLE, bail_if_not_query=True))
+            elif prev_word == "AS":
+                # name AS (SELECT ...) is a CTE only inside a WITH list;
+                # CREATE VIEW v AS (SELECT ...) is left to ANTLR
+                level = frames[-1] if frames else root
+                if level.current_with is None:
+                    return None
+                level.current_with.names.add(clean_ident(prev2))
+                frames.append(_Frame(state, bail_if_not_query=True))
+            else:
+                frames.append(_Frame(state, bail_if_not_query=False))
+            state = _IDLE
+        elif tok == ")":
+            if not frames:
+                return None
+            state = frames.pop().resume_state
+            is_query = frames[-1].is_query is not False if frames else True
+            has_alias = False
+        elif not is_query:
+            pass
+        elif state == _EXPECT_TABLE:
+            if kind != "ident" or word in _FROM_ITEM_END or word == "SELECT":
+                return None
+            pending = tok
+        elif word == "FROM" or (word == "JOIN" and prev_word != "ARRAY"):
+            state = _EXPECT_TABLE
+        elif word == "WITH":
+            level = frames[-1] if frames else root
+            level.current_with = _WithGroup(pos, level.after_union)
+            level.with_groups.append(level.current_with)
+            state = _IDLE
+        elif word == "SELECT":
+            (frames[-1] if frames else root).current_with = None
+            state = _IDLE
+        elif word in ("UNION", "EXCEPT", "INTERSECT"):
+            level = frames[-1] if frames else root
+            level.after_union = True
+            for group in level.with_groups:
+                if group.branch_local and group.end > pos:
+                    group.end = pos
+            state = _IDLE
+        elif state == _AFTER_TABLE:
+            if tok == ",":
+                state = _EXPECT_TABLE
+            elif word == "AS" or word == "FINAL":
+                pass
+            elif kind == "ident" and not has_alias and word not in _FROM_ITEM_END:
+                has_alias = True
+            else:
+                state = _IDLE
+
+        prev2, prev, prev_word = prev, tok, word
+
+    if pending is not None:
+        if pending.endswith("."):
+            return None
+        refs.append((pending, pos, [root, *frames]))
+        state = _AFTER_TABLE
+    if frames or state == _EXPECT_TABLE:
+        return None
+
+    tables: Set[str] = set()
+    for raw, ref_pos, levels in refs:
+        norm, tbl = normalize_table_name(raw, default_db)
+        # Exclude CTEs in scope by name (unqualified compare)
+        if any(
+            tbl in group.names and group.start <= ref_pos < group.end
+            for level in levels
+            for group in level.with_groups
+        ):
+            continue
+        tables.add(norm)
+    return sorted(tables)
 
 
 # ----------------------------
@@ -104,111 +320,71 @@ def normalize_table_name(
 
 class TableNameCollector(ClickHouseParserVisitor):
     """
-    Best-effort table collector for ClickHouse SQL parse trees.
-
-    Grammar evolves; instead of relying on one exact rule name, this visitor:
-    - Searches for context types whose class name suggests table identifiers
-    - Extracts identifier text from those contexts
-    - Tries to avoid collecting CTE names (WITH ...)
-    - Tries to avoid collecting function names / columns by being conservative
-      (still best-effort; validate against your grammar version)
-
-    If you want 100% precision, tailor visit methods to your specific
-    generated ClickHouseParser rules for:
-      - tableExpr / tableExpression
-      - joinExpr
-      - tableIdentifier
-      - tableFunctionExpr (exclude)
-      - cte statements (exclude)
+    Table collector for ClickHouse SQL parse trees.
+
+    Collects the tableIdentifier of every tableExpr identifier, which is how
+    the grammar models a table reference in FROM / JOIN (including nested
+    subqueries). The view's own name and TO target are plain tableIdentifier
+    rules outside tableExpr, so they are not collected.
+
+    - CTE names (WITH name AS (...)) are excluded within the SELECT that defines them
+    - Table functions (tableExprFunction) are not collected
     """
 
     def __init__(self, default_db: Optional[str]):
         super().__init__()
         self.default_db = default_db
-        self.tables: Set[str] = set()
-        self.cte_names: Set[str] = set()
-
-    # --- CTE capture (best-effort) ---
-    def visitWithClause(self, ctx):  # type: ignore[override]
-        # Try to collect CTE aliases so we can exclude them later.
-        # Depending on grammar, ctx might have children like: withExprList / withExpr
-        # We'll do a generic walk and look for patterns resembling "name AS (select ...)".
-        text = ctx.getText()
-        # Extremely heuristic: capture leading identifiers before "AS("
-        # Example: WITH cte AS (SELECT ...) SELECT ...
-        for m in re.finditer(r'([A-Za-z_][A-Za-z0-9_]*)(?=AS\()', text, flags=re.IGNORECASE):
-            self.cte_names.add(clean_ident(m.group(1)))
-        return self.visitChildren(ctx)
+        # Views reference a handful of tables; a list scan beats hashing here
+        self.tables: List[str] = []
+        # CTE names visible at the current point, one scope per enclosing WITH
+        self._cte_stack: List[Set[str]] = []
+
+    # --- CTE scopes ---
+    def visitSelectUnionStmt(self, ctx):  # type: ignore[override]
+        # ClickHouse applies the first SELECT's WITH to every UNION branch and
+        # subquery (enable_global_with_statement), so scope it to the whole union.
+        # Error-recovered trees may lack the first branch or its selectStmt.
+        first_parens = ctx.selectStmtWithParens(0)
+        first = first_parens.selectStmt() if first_parens is not None else None
+        with_clause = first.withClause() if first is not None else None
+        return self._visit_with_cte_scope(ctx, with_clause)
+
+    def visitSelectStmt(self, ctx):  # type: ignore[override]
+        # A WITH on a later UNION branch is visible in that SELECT only; the first
+        # branch's WITH is already in scope from visitSelectUnionStmt. A selectStmt
+        # can also be the parse root (the selectStmt entry rule) or sit in an
+        # error-recovered tree, with no enclosing union.
+        parens = ctx.parentCtx
+        union = parens.parentCtx if parens is not None else None
+        if (
+            isinstance(union, ClickHouseParser.SelectUnionStmtContext)
+            and union.selectStmtWithParens(0) is parens
+        ):
+            return self.visitChildren(ctx)
+        return self._visit_with_cte_scope(ctx, ctx.withClause())
 
-    # --- Core extraction heuristics ---
-    def visitChildren(self, node):  # type: ignore[override]
-        # Before default recursion, attempt to extract if this looks like a table identifier context.
-        cls_name = type(node).__name__
-
-        # These names are common in ClickHouse grammars; adjust if needed.
-        looks_like_table_ctx = any(
-            key in cls_name.lower()
-            for key in [
-                "tableidentifier",
-                "tableexpr",
-                "tableexpression",
-                "join",
-                "fromclause",
-            ]
-        )
-
-        if looks_like_table_ctx:
-            self._try_extract_table_like_text(node)
-
-        return super().visitChildren(node)
-
-    def _try_extract_table_like_text(self, ctx) -> None:
-        """
-        Attempt to extract table names from a context by checking for
-        subrules/methods often present in the generated parser.
-        """
-        # 1) Prefer explicit tableIdentifier() if present
-        if hasattr(ctx, "tableIdentifier"):
-            try:
-                ti = ctx.tableIdentifier()
-                if ti is not None:
-                    self._add_table_text(ti.getText())
-            except Exception:
-                pass
+    def _visit_with_cte_scope(self, ctx, with_clause):
+        if with_clause is None:
+            return self.visitChildren(ctx)
 
-        # 2) Some grammars use tableIdentifierWithDot / compoundIdentifier
-        for meth in ["compoundIdentifier", "identifierOrNull", "identifier"]:
-            if hasattr(ctx, meth):
-                try:
-                    sub = getattr(ctx, meth)()
-                    # If it's a list, iterate; else treat as single.
-                    if sub is None:
-                        continue
-                    if isinstance(sub, list):
-                        # A compound identifier might be split into tokens; fallback to ctx.getText()
-                        # We don't add from bare identifiers; too noisy.
-                        pass
-                except Exception:
-                    pass
-
-        # 3) Last-resort: look for patterns after FROM/JOIN in ctx.getText()
-        # This is *not* the main mechanism; it only helps when grammar method
-        # names differ.
-        text = ctx.getText()
-
-        # Avoid table functions like: FROM s3('...') etc by requiring identifier-ish tokens.
-        # Capture:
-        #   FROM db.table
-        #   JOIN `db`.`table`
-        #   FROM table AS t
-        # Keep it simple; ClickHouse allows many constructs.
-        for m in re.finditer(
-            r'\b(?:FROM|JOIN)\b\s*([`"\[]?[A-Za-z_][A-Za-z0-9_]*[`"\]]?(?:\s*\.\s*[`"\[]?[A-Za-z_][A-Za-z0-9_]*[`"\]]?)?)',
-            text,
-            flags=re.IGNORECASE,
-        ):
-            candidate = re.sub(r"\s+", "", m.group(1))
-            self._add_table_text(candidate)
+        # Only the name leaves are read: ctx.getText() would rebuild the whole clause text.
+        scope: Set[str] = set()
+        for expr in with_clause.withExprList().withExpr():
+            if isinstance(expr, ClickHouseParser.WithExprSubqueryContext):
+                scope.add(clean_ident(expr.identifier().getText()))
+
+        self._cte_stack.append(scope)
+        try:
+            return self.visitChildren(ctx)
+        finally:
+            self._cte_stack.pop()
+
+    # --- Table references ---
+    def visitTableExprIdentifier(self, ctx):  # type: ignore[override]
+        ti = ctx.tableIdentifier()
+        if ti is not None:
+            self._add_table_text(ti.getText())
+        return self.visitChildren(ctx)
 
     def _add_table_text(self, raw: str) -> None:
         raw = raw.strip()
@@ -220,20 +396,59 @@ class TableNameCollector(ClickHouseParserVisitor):
             return
 
         # If grammar gave us something like db.table or table
-        norm = normalize_table_name(raw, self.default_db)
+        norm, tbl = normalize_table_name(raw, self.default_db)
 
-        # Exclude CTEs by name (unqualified compare)
-        _, tbl = split_qualified(norm)
-        if tbl in self.cte_names:
+        # Exclude CTEs in scope by name (unqualified compare)
+        if any(tbl in scope for scope in self._cte_stack):
             return
 
-        self.tables.add(norm)
+        if norm not in self.tables:
+            self.tables.append(norm)
 
 
+# ANTLR results are cached per DDL text; set CH_VIEW_DEPS_CACHE_DIR to relocate.
+PARSE_CACHE_DIR = Path(
+    os.getenv("CH_VIEW_DEPS_CACHE_DIR", str(Path.home() / ".cache" / "ch_view_deps"))
+)
+# Bump whenever TableNameCollector output changes so stale entries are ignored.
+_PARSE_CACHE_VERSION = 5
+
 def parse_view_tables(ddl: str, default_db: Optional[str]) -> List[str]:
     """
     Parse a CREATE VIEW/MV/LIVE VIEW statement and return referenced tables.
+    Most DDLs are handled by the single-pass scanner; the rest go through ANTLR.
     """
+    tables = extract_tables_dfa(ddl, default_db)
+    if tables is not None:
+        return tables
+
+    return _parse_view_tables_cached(ddl, default_db)
+
+def _parse_view_tables_cached(ddl: str, default_db: Optional[str]) -> List[str]:
+    """ANTLR parse, memoized on disk by DDL hash."""
+    cache_path = _parse_cache_path(ddl, default_db)
+    try:
+        return json.loads(cache_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        pass
+
+    tables = _parse_view_tables_antlr(ddl, default_db)
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        # Write-then-rename so concurrent parser processes never see partial files
+        tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(tables), encoding="utf-8")
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass  # cache is best-effort
+    return tables
+
+def _parse_cache_path(ddl: str, default_db: Optional[str]) -> Path:
+    key_src = f"{_PARSE_CACHE_VERSION}\0{default_db}\0{ddl}"
+    key = hashlib.blake2b(key_src.encode(), digest_size=16).hexdigest()
+    return PARSE_CACHE_DIR / f"{key}.json"
+
+def _parse_view_tables_antlr(ddl: str, default_db: Optional[str]) -> List[str]:
     input_stream = InputStream(ddl)
     lexer = ClickHouseLexer(input_stream)
     stream = CommonTokenStream(lexer)
@@ -262,6 +477,9 @@ def parse_view_tables(ddl: str, default_db: Optional[str]) -> List[str]:
 # ClickHouse access
 # ----------------------------
 
+# Number of concurrent DDL fetches (and pooled ClickHouse clients)
+FETCH_WORKERS = 8
+
 @dataclass(frozen=True)
 class CHConnInfo:
     host: str
@@ -280,7 +498,9 @@ def get_conn_info_from_env() -> CHConnInfo:
     secure = os.getenv("CH_SECURE", "0").lower() in ("1", "true", "yes")
     return CHConnInfo(host, port, username, password, database, secure)
 
-def connect_ch(ci: CHConnInfo):
+def connect_ch(ci: CHConnInfo, pool_mgr=None):
+    # Metadata result sets are small and mostly text: lz4 is far cheaper on CPU than
+    # the default gzip. No server session is needed for these stateless queries.
     return clickhouse_connect.get_client(
         host=ci.host,
         port=ci.port,
@@ -288,8 +508,22 @@ def connect_ch(ci: CHConnInfo):
         password=ci.password,
         database=ci.database,
         secure=ci.secure,
+        compress="lz4",
+        autogenerate_session_id=False,
+        pool_mgr=pool_mgr,
     )
 
+def _query_tuples(client, sql: str, parameters: Optional[dict] = None) -> List[Tuple]:
+    """
+    Run a query and return its rows as tuples, built by zipping column blocks
+    rather than having the driver pivot each block into Python rows first.
+    """
+    rows: List[Tuple] = []
+    with client.query_column_block_stream(sql, parameters=parameters) as stream:
+        for block in stream:
+            rows.extend(zip(*block, strict=True))
+    return rows
+
 def fetch_views(client, include_system: bool = False) -> List[Tuple[str, str, str]]:
     """
     Returns list of (database, name, engine).
@@ -304,8 +538,7 @@ def fetch_views(client, include_system: bool = False) -> List[Tuple[str, str, st
           {where_db}
         ORDER BY database, name
     """
-    rows = client.query(sql).result_rows
-    return [(r[0], r[1], r[2]) for r in rows]
+    return _query_tuples(client, sql)
 
 def fetch_tables(client, include_system: bool = False) -> List[Tuple[str, str, str]]:
     """
@@ -320,44 +553,115 @@ def fetch_tables(client, include_system: bool = False) -> List[Tuple[str, str, s
           {where_db}
         ORDER BY database, name
     """
-    rows = client.query(sql).result_rows
-    return [(r[0], r[1], r[2]) for r in rows]
+    return _query_tuples(client, sql)
 
-def fetch_view_ddl(client, database: str, name: str) -> str:
+def fetch_all_view_ddls(client, views) -> Dict[Tuple[str, str], str]:
     """
-    Prefer system.tables.create_table_query (fast), fallback to SHOW CREATE TABLE.
+    Fetch create_table_query for all (database, name, engine) views in a single query.
+    Returns {(database, name): ddl}; views with an empty DDL are omitted.
     """
+    if not views:
+        return {}
     ddl_sql = """
-        SELECT create_table_query
+        SELECT database, name, create_table_query
         FROM system.tables
-        WHERE database = %(db)s AND name = %(name)s
-        LIMIT 1
+        WHERE has(%(pairs)s, (database, name))
     """
-    res = client.query(ddl_sql, parameters={"db": database, "name": name}).result_rows
-    if res and res[0] and res[0][0]:
-        return res[0][0]
+    pairs = [(db, n) for db, n, _ in views]
+    rows = _query_tuples(client, ddl_sql, parameters={"pairs": pairs})
+    return {(db, n): ddl for db, n, ddl in rows if ddl}
 
+def _show_create_ddl(client, database: str, name: str) -> str:
     show_sql = f"SHOW CREATE TABLE `{database}`.`{name}`"
     show = client.query(show_sql).result_rows
     if not show:
         raise RuntimeError(f"Could not fetch DDL for {database}.{name}")
     return show[0][0]
 
-def _views_to_json(client, views):
+def make_client_pool(client, connect: Optional[Callable[[], Any]], size: int) -> "queue.Queue":
+    """
+    Pool of `size` ClickHouse clients: `client` plus `size - 1` new ones from
+    `connect()` (only `client` when `connect` is None). Worker threads reuse
+    their HTTP keep-alive connections instead of opening new ones.
+    """
+    pool: "queue.Queue" = queue.Queue()
+    pool.put(client)
+    if connect is not None:
+        for _ in range(size - 1):
+            pool.put(connect())
+    return pool
+
+def _show_create_ddl_pooled(client_pool: "queue.Queue", database: str, name: str) -> str:
+    client = client_pool.get()
+    try:
+        return _show_create_ddl(client, database, name)
+    finally:
+        client_pool.put(client)
+
+def _views_to_json(
+    client,
+    views,
+    connect: Optional[Callable[[], Any]] = None,
+    max_workers: int = FETCH_WORKERS,
+):
+    """
+    Fetch all view DDLs in one query, falling back to SHOW CREATE TABLE on a
+    thread pool for the (rare) views without create_table_query. Extra clients
+    for the fallback are created with `connect()` only when needed.
+
+    DDLs are scanned in this process; only those the scanner can't handle are
+    sent to a process pool for ANTLR (pure Python and GIL-bound).
+    """
     result: Dict[str, List[str]] = {}
     errors: Dict[str, str] = {}
 
-    for db, view_name, _engine in views:
+    ddls = fetch_all_view_ddls(client, views)
+    missing = [(db, view_name) for db, view_name, _engine in views if (db, view_name) not in ddls]
+    if missing:
+        workers = min(max_workers, len(missing))
+        client_pool = make_client_pool(client, connect, workers)
+        with ThreadPoolExecutor(max_workers=workers) as fetch_pool:
+            fetches = {
+                fetch_pool.submit(_show_create_ddl_pooled, client_pool, *key): key
+                for key in missing
+            }
+            for fut in as_completed(fetches):
+                db, view_name = fetches[fut]
+                try:
+                    ddls[(db, view_name)] = fut.result()
+                except Exception as e:
+                    # Keep going; store error for visibility
+                    errors[f"{db}.{view_name}"] = f"{type(e).__name__}: {e}"
+
+    # The scanner takes microseconds; a process round-trip would cost more than the parse
+    antlr_ddls: Dict[str, Tuple[str, str]] = {}
+    for (db, view_name), ddl in ddls.items():
         fq_view = f"{db}.{view_name}"
-        try:
-            ddl = fetch_view_ddl(client, db, view_name)
-            tables = parse_view_tables(ddl, default_db=db)
+        tables = extract_tables_dfa(ddl, db)
+        if tables is None:
+            antlr_ddls[fq_view] = (ddl, db)
+        else:
             result[fq_view] = tables
-        except Exception as e:
-            # Keep going; store error for visibility
-            errors[fq_view] = f"{type(e).__name__}: {e}"
 
-    payload = {"view_dependencies": result, "errors": errors}
+    if antlr_ddls:
+        workers = min(len(antlr_ddls), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers) as parse_pool:
+            parses = {
+                parse_pool.submit(_parse_view_tables_cached, ddl, db): fq_view
+                for fq_view, (ddl, db) in antlr_ddls.items()
+            }
+            for fut in as_completed(parses):
+                fq_view = parses[fut]
+                try:
+                    result[fq_view] = fut.result()
+                except Exception as e:
+                    errors[fq_view] = f"{type(e).__name__}: {e}"
+
+    # Keep output order stable regardless of completion order
+    payload = {
+        "view_dependencies": dict(sorted(result.items())),
+        "errors": dict(sorted(errors.items())),
+    }
     return payload
 
 # ----------------------------
@@ -378,21 +682,25 @@ def main() -> None:
     args = parser.parse_args()
         
     ci = get_conn_info_from_env()
-    client = connect_ch(ci)
+    # One shared keep-alive pool for the main client and any fallback clients
+    pool_mgr = httputil.get_pool_manager(maxsize=FETCH_WORKERS, block=False)
+    client = connect_ch(ci, pool_mgr=pool_mgr)
 
     print(f"Fetching views and tables from ClickHouse at {ci.host}:{ci.port}...")
     views = fetch_views(client, include_system=False)
     tables = {f"{db}.{name}" for db, name, _ in fetch_tables(client, include_system=False)}
 
-    payload = _views_to_json(client, views)    
-   
-    print(f"Converting to Mermaid diagram...")
-    mermaid_graph = json_to_mermaid(payload, tables, options=MermaidOptions(include_isolated_nodes=False))
+    connect = functools.partial(connect_ch, ci, pool_mgr=pool_mgr)
+    payload = _views_to_json(client, views, connect=connect, max_workers=FETCH_WORKERS)
    
     print(f"Writing Mermaid diagram to: {args.output}")
     out_path = Path(args.output)
     out_path.parent.mkdir(parents=True, exist_ok=True)
-    out_path.write_text(mermaid_graph, encoding="utf-8", newline="\n")
-   
+    mermaid_lines = iter_json_to_mermaid(
+        payload, tables, options=MermaidOptions(include_isolated_nodes=False)
+    )
+    with out_path.open("w", encoding="utf-8", newline="\n") as out_file:
+        out_file.writelines(mermaid_lines)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -3,8 +3,10 @@ from __future__ import annotations
 
 import json
 import re
+from collections.abc import Iterator
+from collections.abc import Set as AbstractSet
 from dataclasses import dataclass
-from typing import Any, Dict, List, Mapping, Sequence, Set, Tuple
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Set, Tuple
 
 
 @dataclass(frozen=True)
@@ -24,7 +26,7 @@ class MermaidDependencyGraphError(ValueError):
 
 def json_to_mermaid(
     data: Mapping[str, Any],
-    tables: Set[str] = {},
+    tables: Optional[AbstractSet[str]] = None,
     *,
     options: MermaidOptions = MermaidOptions()
 ) -> str:
@@ -35,7 +37,24 @@ def json_to_mermaid(
     Rules:
       1) Node name matches the string in JSON (no quotes added).
       2) Edges use '-.->'
+      3) Nodes listed in `tables` get the chTable class, all others chView.
     """
+    return "".join(iter_json_to_mermaid(data, tables, options=options))
+
+
+def iter_json_to_mermaid(
+    data: Mapping[str, Any],
+    tables: Optional[AbstractSet[str]] = None,
+    *,
+    options: MermaidOptions = MermaidOptions()
+) -> Iterator[str]:
+    """
+    Same as json_to_mermaid, but yields the diagram line by line (each ending
+    in a newline) so it can be streamed to a file. Input is validated eagerly.
+    """
+    if tables is None:
+        tables = frozenset()
+
     if "view_dependencies" not in data:
         raise MermaidDependencyGraphError("Missing required key: 'view_dependencies'")
 
@@ -52,10 +71,7 @@ def json_to_mermaid(
         if deps is None:
             deps_list: List[str] = []
         elif isinstance(deps, list):
-            if not all(isinstance(x, str) for x in deps):
-                raise MermaidDependencyGraphError(
-                    f"Dependencies for '{view}' must be a list of strings"
-                )
+            # Element types are checked while collecting nodes in _deps_to_mermaid_iter
             deps_list = deps
         else:
             raise MermaidDependencyGraphError(
@@ -64,7 +80,7 @@ def json_to_mermaid(
 
         view_deps[view] = deps_list
 
-    return _deps_to_mermaid(view_deps, tables, options=options)
+    return _deps_to_mermaid_iter(view_deps, tables, options=options)
 
 
 def loads_json_to_mermaid(
@@ -86,66 +102,83 @@ def loads_json_to_mermaid(
     return json_to_mermaid(data, options=options)
 
 
-def _deps_to_mermaid(
+def _deps_to_mermaid_iter(
     view_deps: Mapping[str, Sequence[str]],
-    tables: Set[str],
+    tables: AbstractSet[str],
     *,
     options: MermaidOptions
-) -> str:
+) -> Iterator[str]:
+    # Validation and collection run now; only rendering is deferred to the generator
+    tables = frozenset(tables)
     direction = options.direction.strip().upper()
     if direction not in {"LR", "TB", "RL", "BT"}:
         raise MermaidDependencyGraphError("options.direction must be one of LR, TB, RL, BT")
 
-    # Collect nodes and edges
+    # Collect nodes, edges (deduped on the fly) and connected nodes in one pass
     nodes: Set[str] = set()
     edges: List[Tuple[str, str]] = []
+    seen: Set[Tuple[str, str]] = set()
+    connected: Set[str] = set()
+    # Bound-method aliases avoid attribute lookups in the loop
+    nodes_add = nodes.add
+    edges_append = edges.append
+    seen_add = seen.add
+    connected_add = connected.add
+    dedupe_edges = options.dedupe_edges
 
     for view, deps in view_deps.items():
-        nodes.add(view)
+        nodes_add(view)
 
         for dep in deps:
-            nodes.add(dep)
-            edges.append((dep, view))
-
-    if options.dedupe_edges:
-        seen: Set[Tuple[str, str]] = set()
-        deduped: List[Tuple[str, str]] = []
-        for e in edges:
-            if e not in seen:
-                seen.add(e)
-                deduped.append(e)
-        edges = deduped
-
-    lines: List[str] = [f"graph {direction}",
-                        f"{options.indent}classDef chTable fill:#ffdd00,stroke:#000000,stroke-width:2px,color:#000000",
-                        f"{options.indent}classDef chView fill:#d6e4f8,stroke:#154360,stroke-width:2px,color:#154360",
-                        ""]
-
-    # Render nodes with types
-    for n in nodes:
-        if n in tables:
-            lines.append(f"{options.indent}{n}:::chTable")
-        else:
-            lines.append(f"{options.indent}{n}:::chView")
-
-    lines.append("")
+            if not isinstance(dep, str):
+                raise MermaidDependencyGraphError(
+                    f"Dependencies for '{view}' must be a list of strings"
+                )
+            nodes_add(dep)
+            edge = (dep, view)
+            if dedupe_edges:
+                if edge in seen:
+                    continue
+                seen_add(edge)
+            edges_append(edge)
+            connected_add(dep)
+            connected_add(view)
+
+    return _render_mermaid_lines(direction, nodes, edges, connected, tables, options)
+
+
+def _render_mermaid_lines(
+    direction: str,
+    nodes: Set[str],
+    edges: List[Tuple[str, str]],
+    connected: Set[str],
+    tables: frozenset[str],
+    options: MermaidOptions,
+) -> Iterator[str]:
+    indent = options.indent
+
+    yield f"graph {direction}\n"
+    yield f"{indent}classDef chTable fill:#ffdd00,stroke:#000000,stroke-width:2px,color:#000000\n"
+    yield f"{indent}classDef chView fill:#d6e4f8,stroke:#154360,stroke-width:2px,color:#154360\n"
+    yield "\n"
+
+    # Render nodes with types: tables first, then views, each sorted for stable output
+    for n in sorted(nodes & tables):
+        yield f"{indent}{n}:::chTable\n"
+    for n in sorted(nodes - tables):
+        yield f"{indent}{n}:::chView\n"
+
+    yield "\n"
 
     # Render edges
     if edges:
         for src, dst in edges:
-            lines.append(f"{options.indent}{src} -.-> {dst}")
+            yield f"{indent}{src} -.-> {dst}\n"
     elif options.include_isolated_nodes:
         for n in sorted(nodes):
-            lines.append(f"{options.indent}{n}")
+            yield f"{indent}{n}\n"
 
     if options.include_isolated_nodes and edges:
-        connected: Set[str] = set()
-        for src, dst in edges:
-            connected.add(src)
-            connected.add(dst)
-
         isolated = sorted(nodes - connected)
         for n in isolated:
-            lines.append(f"{options.indent}{n}")
-
-    return "\n".join(lines) + "\n"
\ No newline at end of file
+            yield f"{indent}{n}\n"
@@ -0,0 +1,299 @@
+# tests/test_ch_view_dependencies.py
+import contextlib
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import ch_view_dependencies
+from ch_view_dependencies import (
+    _views_to_json,
+    extract_tables_dfa,
+    fetch_all_view_ddls,
+    parse_view_tables,
+)
+
+
+class FakeClient:
+    """Answers the batched system.tables DDL query and SHOW CREATE TABLE."""
+
+    def __init__(self, ddls, show_create=None):
+        self.ddls = ddls
+        self.show_create = show_create or {}
+        self.queries = []
+
+    @contextlib.contextmanager
+    def query_column_block_stream(self, sql, parameters=None):
+        self.queries.append(sql)
+        pairs = [pair for pair in parameters["pairs"] if pair in self.ddls]
+        columns = [[db for db, _ in pairs], [n for _, n in pairs], [self.ddls[p] for p in pairs]]
+        yield iter([columns] if pairs else [])
+
+    def query(self, sql, parameters=None):
+        self.queries.append(sql)
+        db, name = re.match(r"SHOW CREATE TABLE `(.*)`\.`(.*)`", sql).groups()
+        ddl = self.show_create.get((db, name))
+        return SimpleNamespace(result_rows=[(ddl,)] if ddl else [])
+
+
+@pytest.fixture(autouse=True)
+def parse_cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(ch_view_dependencies, "PARSE_CACHE_DIR", tmp_path)
+    return tmp_path
+
+
+def test_extract_tables_dfa_from_and_joins():
+    ddl = (
+        "CREATE VIEW test.v AS SELECT * FROM test.a AS a "
+        "INNER JOIN `test`.`b` USING id LEFT JOIN c ON c.id = a.id"
+    )
+    assert extract_tables_dfa(ddl, "test") == ["test.a", "test.b", "test.c"]
+
+
+def test_extract_tables_dfa_ignores_comments_and_strings():
+    ddl = (
+        "CREATE VIEW test.v AS SELECT 'FROM fake' AS s -- JOIN nope\n"
+        "FROM /* FROM hidden */ other.t"
+    )
+    assert extract_tables_dfa(ddl, "test") == ["other.t"]
+
+
+def test_extract_tables_dfa_excludes_ctes():
+    ddl = (
+        "CREATE VIEW test.v AS WITH c AS (SELECT * FROM test.a), d AS (SELECT 1) "
+        "SELECT * FROM c JOIN d USING x"
+    )
+    assert extract_tables_dfa(ddl, "test") == ["test.a"]
+
+
+def test_extract_tables_dfa_subqueries_and_comma_joins():
+    ddl = (
+        "CREATE VIEW test.v AS SELECT * FROM (SELECT x FROM test.a) AS s, other.b "
+        "WHERE x IN (SELECT y FROM c) ORDER BY x, y"
+    )
+    assert extract_tables_dfa(ddl, "test") == ["other.b", "test.a", "test.c"]
+
+
+def test_extract_tables_dfa_skips_non_table_from_and_join():
+    ddl = (
+        "CREATE VIEW v AS SELECT EXTRACT(YEAR FROM d), trim(BOTH ' ' FROM s), t.from "
+        "FROM a AS t ARRAY JOIN arr JOIN numbers(10) AS n ON 1"
+    )
+    assert extract_tables_dfa(ddl, None) == ["a"]
+
+
+def test_extract_tables_dfa_defers_unmodelled_constructs():
+    assert extract_tables_dfa("CREATE VIEW v AS SELECT * FROM (a JOIN b ON 1)", None) is None
+    assert extract_tables_dfa("CREATE VIEW v AS SELECT * FROM (SELECT 1", None) is None
+    assert extract_tables_dfa("CREATE VIEW v AS SELECT * FROM", None) is None
+
+
+def test_parse_view_tables_falls_back_to_antlr():
+    ddl = "CREATE VIEW test.v AS SELECT x FROM (test.a JOIN other.b USING x)"
+    assert parse_view_tables(ddl, "test") == ["other.b", "test.a"]
+
+
+def test_parse_view_tables_antlr_excludes_ctes():
+    ddl = (
+        "CREATE VIEW test.v AS WITH c AS (SELECT * FROM (test.a JOIN test.d USING y)) "
+        "SELECT * FROM c JOIN other.b USING x"
+    )
+    assert parse_view_tables(ddl, "test") == ["other.b", "test.a", "test.d"]
+
+
+def test_cte_names_are_scoped_to_their_select():
+    # The outer "c" is a real table; only the subquery's WITH defines a CTE "c"
+    ddl = (
+        "CREATE VIEW v AS SELECT * FROM (WITH c AS (SELECT 1 FROM x) SELECT * FROM c) AS s "
+        "JOIN c USING k"
+    )
+    assert extract_tables_dfa(ddl, "test") == ["test.c", "test.x"]
+
+    antlr_ddl = (
+        "CREATE VIEW v AS SELECT * FROM "
+        "(a JOIN (WITH c AS (SELECT 1 FROM x) SELECT * FROM c) AS s ON 1) JOIN c USING k"
+    )
+    assert extract_tables_dfa(antlr_ddl, "test") is None
+    assert parse_view_tables(antlr_ddl, "test") == ["test.a", "test.c", "test.x"]
+
+
+def test_leading_cte_is_in_scope_for_every_union_branch():
+    ddl = (
+        "CREATE VIEW v AS WITH c AS (SELECT * FROM t) SELECT * FROM c "
+        "UNION ALL SELECT * FROM (a JOIN c USING x)"
+    )
+    assert extract_tables_dfa(ddl, "db") is None
+    assert parse_view_tables(ddl, "db") == ["db.a", "db.t"]
+
+
+def test_antlr_collector_handles_select_stmt_without_union_parent():
+    # The grammar rejects the MV engine clause; the error-recovered tree must not crash
+    ddl = (
+        "CREATE MATERIALIZED VIEW db.mv ENGINE = MergeTree ORDER BY a POPULATE "
+        "AS SELECT a FROM (db.x JOIN db.y USING a)"
+    )
+    assert extract_tables_dfa(ddl, "db") is None
+    assert isinstance(parse_view_tables(ddl, "db"), list)
+
+    # selectStmt as the parse root (the last entry rule _parse_view_tables_antlr tries)
+    sql = "WITH c AS (SELECT 1 FROM x) SELECT * FROM c, d"
+    root = ch_view_dependencies.ClickHouseParser(
+        ch_view_dependencies.CommonTokenStream(
+            ch_view_dependencies.ClickHouseLexer(ch_view_dependencies.InputStream(sql))
+        )
+    ).selectStmt()
+    collector = ch_view_dependencies.TableNameCollector(default_db="db")
+    collector.visit(root)
+    assert sorted(collector.tables) == ["db.d", "db.x"]
+
+
+@pytest.mark.parametrize(
+    "ddl, scanned",
+    [
+        # A CTE body may refer to a CTE defined later in the same WITH list
+        (
+            "CREATE VIEW v AS WITH a AS (SELECT * FROM b), b AS (SELECT * FROM t) SELECT * FROM a",
+            True,
+        ),
+        (
+            "CREATE VIEW v AS WITH c AS (SELECT * FROM t) SELECT * FROM c "
+            "UNION ALL SELECT * FROM c",
+            True,
+        ),
+        (
+            "CREATE VIEW v AS SELECT 1 FROM c UNION ALL WITH c AS (SELECT 1 FROM x) "
+            "SELECT * FROM c UNION ALL SELECT 2 FROM c",
+            True,
+        ),
+        (
+            "CREATE VIEW v AS WITH c AS (SELECT 1 FROM x) "
+            "SELECT * FROM (SELECT * FROM c) JOIN d USING k",
+            True,
+        ),
+        # "AS (" outside a WITH list is not a CTE: the view's own name must not hide raw.events
+        ("CREATE VIEW analytics.events AS (SELECT * FROM raw.events)", False),
+        # Non-CTE constructs the scanner handles on its own
+        (
+            "CREATE VIEW v AS SELECT * FROM remote('h', db.r) AS r "
+            "JOIN numbers(10) AS n ON 1 JOIN db.t USING k",
+            True,
+        ),
+        ("CREATE VIEW v AS SELECT a FROM db.t JOIN u USING k ARRAY JOIN arr AS a", True),
+        ("CREATE VIEW v AS SELECT a FROM db.t LEFT ARRAY JOIN arr AS a", True),
+        (
+            "CREATE VIEW v AS SELECT EXTRACT(YEAR FROM d), TRIM(BOTH 'x' FROM s) "
+            "FROM db.t WHERE x IN (SELECT x FROM u)",
+            True,
+        ),
+        ("CREATE VIEW v AS SELECT * FROM db.t AS x, (SELECT * FROM u) AS y, w FINAL", True),
+        ("CREATE VIEW v AS SELECT * FROM (SELECT * FROM t UNION ALL SELECT * FROM u)", True),
+        # Parenthesized top-level SELECT: deferred to ANTLR
+        ("CREATE VIEW v AS (SELECT * FROM t UNION ALL SELECT * FROM u)", False),
+    ],
+)
+def test_extract_tables_dfa_matches_antlr(ddl, scanned):
+    expected = ch_view_dependencies._parse_view_tables_antlr(ddl, "db")
+    if scanned:
+        assert extract_tables_dfa(ddl, "db") == expected
+    else:
+        assert extract_tables_dfa(ddl, "db") is None
+    assert parse_view_tables(ddl, "db") == expected
+
+
+def test_parse_view_tables_reuses_cached_antlr_result(parse_cache_dir, monkeypatch):
+    ddl = "CREATE VIEW test.v AS SELECT x FROM (test.a JOIN test.b USING x)"
+    assert parse_view_tables(ddl, "test") == ["test.a", "test.b"]
+    assert len(list(parse_cache_dir.glob("*.json"))) == 1
+
+    def fail(*_args):
+        raise AssertionError("ANTLR should not run on a cache hit")
+
+    monkeypatch.setattr(ch_view_dependencies, "_parse_view_tables_antlr", fail)
+    assert parse_view_tables(ddl, "test") == ["test.a", "test.b"]
+
+
+def test_fetch_all_view_ddls_single_query_skips_empty_ddl():
+    client = FakeClient({("db", "v1"): "CREATE VIEW db.v1 AS SELECT 1", ("db", "v2"): ""})
+    views = [("db", "v1", "View"), ("db", "v2", "View"), ("db", "v3", "View")]
+
+    assert fetch_all_view_ddls(client, views) == {("db", "v1"): "CREATE VIEW db.v1 AS SELECT 1"}
+    assert len(client.queries) == 1
+    assert fetch_all_view_ddls(client, []) == {}
+    assert len(client.queries) == 1
+
+
+def test_views_to_json_falls_back_to_show_create_and_records_errors():
+    client = FakeClient(
+        {
+            ("db", "b"): "CREATE VIEW db.b AS SELECT * FROM db.t1",
+            ("db", "a"): "",
+            # Parenthesized join: goes to ANTLR on the process pool
+            ("db", "c"): "CREATE VIEW db.c AS SELECT * FROM (db.t1 JOIN db.t3 USING x)",
+        },
+        show_create={("db", "a"): "CREATE VIEW db.a AS SELECT * FROM db.b JOIN t2 USING x"},
+    )
+    views = [
+        ("db", "b", "View"),
+        ("db", "a", "View"),
+        ("db", "missing", "View"),
+        ("db", "c", "View"),
+    ]
+    connected = []
+
+    def connect():
+        connected.append(1)
+        return client
+
+    payload = _views_to_json(client, views, connect=connect)
+
+    assert list(payload["view_dependencies"]) == ["db.a", "db.b", "db.c"]
+    assert payload["view_dependencies"] == {
+        "db.a": ["db.b", "db.t2"],
+        "db.b": ["db.t1"],
+        "db.c": ["db.t1", "db.t3"],
+    }
+    assert payload["errors"] == {
+        "db.missing": "RuntimeError: Could not fetch DDL for db.missing"
+    }
+    # Only the two views without create_table_query need fallback clients
+    assert len(connected) == 1
+
+
+def test_views_to_json_fetches_on_pooled_clients_and_parses_in_processes():
+    class ExclusiveClient(FakeClient):
+        """Fails if two threads use the same client at once."""
+
+        def __init__(self, show_create):
+            super().__init__({}, show_create)
+            self.lock = threading.Lock()
+
+        def query(self, sql, parameters=None):
+            assert self.lock.acquire(blocking=False), "client shared between threads"
+            try:
+                time.sleep(0.005)
+                return super().query(sql, parameters)
+            finally:
+                self.lock.release()
+
+    show_create = {}
+    for i in range(12):
+        # Odd views need ANTLR (parenthesized join), even ones are scanned in-process
+        source = f"(db.t{i} JOIN db.u USING k)" if i % 2 else f"db.t{i}"
+        show_create[("db", f"v{i:02}")] = f"CREATE VIEW db.v{i:02} AS SELECT * FROM {source}"
+    views = [("db", name, "View") for _db, name in reversed(list(show_create))]
+    clients = []
+
+    def connect():
+        clients.append(ExclusiveClient(show_create))
+        return clients[-1]
+
+    payload = _views_to_json(connect(), views, connect=connect, max_workers=4)
+
+    assert len(clients) == 4
+    assert payload["errors"] == {}
+    assert list(payload["view_dependencies"]) == [f"db.v{i:02}" for i in range(12)]
+    for i in range(12):
+        expected = [f"db.t{i}", "db.u"] if i % 2 else [f"db.t{i}"]
+        assert payload["view_dependencies"][f"db.v{i:02}"] == expected
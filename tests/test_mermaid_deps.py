@@ -4,6 +4,7 @@ import pytest
 from dependencies_to_mermaid import (
     MermaidDependencyGraphError,
     MermaidOptions,
+    iter_json_to_mermaid,
     json_to_mermaid,
     loads_json_to_mermaid,
 )
@@ -152,4 +153,29 @@ def test_loads_json_to_mermaid_invalid_json_raises():
 
 def test_loads_json_to_mermaid_top_level_not_object_raises():
     with pytest.raises(MermaidDependencyGraphError, match="Top-level JSON must be an object"):
-        loads_json_to_mermaid('["not an object"]')
\ No newline at end of file
+        loads_json_to_mermaid('["not an object"]')
+
+def test_iter_json_to_mermaid_yields_lines_matching_json_to_mermaid():
+    data = {"view_dependencies": {"a": ["b", "c"], "isolated": []}}
+    lines = list(iter_json_to_mermaid(data, {"b"}))
+
+    assert all(line.endswith("\n") and line.count("\n") == 1 for line in lines)
+    assert "".join(lines) == json_to_mermaid(data, {"b"})
+
+
+def test_iter_json_to_mermaid_validates_before_iteration():
+    with pytest.raises(MermaidDependencyGraphError, match="list of strings"):
+        iter_json_to_mermaid({"view_dependencies": {"a": [1]}})
+
+
+def test_nodes_are_rendered_sorted_tables_before_views():
+    data = {"view_dependencies": {"v2": ["t2", "v1"], "v1": ["t1"]}}
+    out = json_to_mermaid(data, {"t2", "t1"})
+
+    node_lines = [line for line in out.splitlines() if ":::" in line and "classDef" not in line]
+    assert node_lines == [
+        "  t1:::chTable",
+        "  t2:::chTable",
+        "  v1:::chView",
+        "  v2:::chView",
+    ]